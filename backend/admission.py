@@ -0,0 +1,277 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set
+
+from fastapi import HTTPException
+
+
+class AdmissionRejected(HTTPException):
+    """Raised when a request is shed; carries a Retry-After hint for 429/503 responses"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        self.retry_after = max(1, math.ceil(retry_after)) if retry_after is not None else None
+        headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else None
+        super().__init__(status_code=status_code, detail=detail, headers=headers)
+
+    def to_message(self):
+        """WebSocket error frame equivalent of the HTTP rejection"""
+        return {
+            "type": "error",
+            "status": "rejected",
+            "code": self.status_code,
+            "retry_after": self.retry_after,
+            "message": self.detail,
+        }
+
+
+class Admission:
+    """Handle yielded by AdmissionController.request.
+
+    Call paths that swallow upstream errors (and report them as frames or "Error:"
+    strings) must call fail() so the error counts against the limit instead of
+    looking like a fast success. Upstream calls the request gives up on but cannot
+    stop (a worker thread still blocked on the network) are passed to hold(); each
+    keeps one slot until it finishes, after the request itself has returned.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.failed = False
+        self.held: Set[asyncio.Future] = set()
+
+    def fail(self):
+        self.failed = True
+
+    def hold(self, futures):
+        self.held.update(futures)
+
+
+class AIMDLimit:
+    """Concurrency limit that grows additively and backs off multiplicatively.
+
+    Each completed call reports its latency. While latency stays within `tolerance`
+    times the long-run baseline the limit creeps up by 1/limit per call (about +1 per
+    round trip); a slow or failed call cuts it by `backoff`.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int,
+                 tolerance: float = 2.0, backoff: float = 0.7, smoothing: float = 0.05):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.baseline: Optional[float] = None
+        self.recent: Optional[float] = None
+
+    def on_sample(self, latency: float, ok: bool = True):
+        if not ok:
+            # Failures back off but say nothing about healthy latency (they are often instant)
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            return
+
+        if self.baseline is None:
+            self.baseline = self.recent = latency
+        self.recent = 0.3 * latency + 0.7 * self.recent
+
+        if latency > self.tolerance * self.baseline:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            # Only learn the baseline from healthy samples so overload cannot raise it
+            self.baseline += self.smoothing * (latency - self.baseline)
+
+    def __int__(self):
+        return max(self.min_limit, int(self.limit))
+
+
+class AdmissionController:
+    """Caps concurrent upstream work and enforces per-client quotas for one worker"""
+
+    def __init__(self, initial_concurrency: int = 8, min_concurrency: int = 1, max_concurrency: int = 64,
+                 max_queue: int = 32, queue_timeout: float = 5.0, max_persona_ids: int = 10,
+                 client_max_in_flight: int = 4, client_requests_per_minute: int = 60,
+                 max_connections: int = 200):
+        self.limit = AIMDLimit(initial_concurrency, min_concurrency, max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_persona_ids = max_persona_ids
+        self.client_max_in_flight = client_max_in_flight
+        self.client_requests_per_minute = client_requests_per_minute
+        self.max_connections = max_connections
+
+        self.in_flight = 0
+        self.stranded = 0
+        self.waiting = 0
+        self.background_waiting = 0
+        self.connections = 0
+        self.rejected = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._client_in_flight: Dict[str, int] = {}
+        self._client_buckets: Dict[str, List[float]] = {}
+
+    @property
+    def condition(self):
+        # Created lazily so it binds to the running loop rather than the importing one
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _reject(self, status_code, detail, retry_after=None):
+        self.rejected += 1
+        raise AdmissionRejected(status_code, detail, retry_after)
+
+    def _expected_wait(self):
+        return self.limit.recent or self.queue_timeout
+
+    def check_personas(self, persona_ids):
+        if len(persona_ids) > self.max_persona_ids:
+            self._reject(413, f"Too many personas: {len(persona_ids)} > {self.max_persona_ids}")
+
+    def _take_client_token(self, client_id):
+        rate = self.client_requests_per_minute / 60.0
+        now = time.monotonic()
+        tokens, last = self._client_buckets.get(client_id, (self.client_requests_per_minute, now))
+        tokens = min(self.client_requests_per_minute, tokens + (now - last) * rate)
+        if tokens < 1:
+            self._client_buckets[client_id] = [tokens, now]
+            self._reject(429, "Client request rate exceeded", (1 - tokens) / rate)
+        self._client_buckets[client_id] = [tokens - 1, now]
+
+        if len(self._client_buckets) > 10000:
+            idle = [cid for cid, (_, seen) in self._client_buckets.items() if now - seen > 60]
+            for cid in idle:
+                del self._client_buckets[cid]
+
+    def _free(self):
+        return int(self.limit) - self.in_flight
+
+    def _grant(self, wanted):
+        # Whatever is free right now, up to what was asked for; callers run the rest in waves
+        slots = min(wanted, self._free())
+        self.in_flight += slots
+        return slots
+
+    async def _acquire(self, wanted=1, background=False):
+        """Wait until at least one slot is free and take up to `wanted`; returns how many were granted"""
+        if self._free() >= 1:
+            return self._grant(wanted)
+        if background:
+            # Batch work already admitted: wait as long as it takes, outside the interactive queue
+            self.background_waiting += 1
+            try:
+                async with self.condition:
+                    await self.condition.wait_for(lambda: self._free() >= 1)
+                    return self._grant(wanted)
+            finally:
+                self.background_waiting -= 1
+        if self.waiting >= self.max_queue:
+            self._reject(503, "Server overloaded, try again later", self._expected_wait())
+
+        self.waiting += 1
+        try:
+            async with self.condition:
+                await asyncio.wait_for(self.condition.wait_for(lambda: self._free() >= 1), timeout=self.queue_timeout)
+                return self._grant(wanted)
+        except asyncio.TimeoutError:
+            self._reject(503, "Server overloaded, try again later", self._expected_wait())
+        finally:
+            self.waiting -= 1
+
+    async def _release(self, slots=1):
+        self.in_flight -= slots
+        async with self.condition:
+            self.condition.notify_all()
+
+    def _release_when_done(self, future):
+        # One slot per stranded call, released when its thread finally returns
+        self.stranded += 1
+
+        def done(_):
+            self.stranded -= 1
+            asyncio.ensure_future(self._release(1))
+
+        future.add_done_callback(done)
+
+    @asynccontextmanager
+    async def request(self, client_id: str, persona_ids: Optional[List[str]] = None):
+        """Admit one request: bound its personas, charge the client's quota, then wait for upstream slots.
+
+        A multi-persona request asks for one slot per persona and yields an Admission
+        whose `slots` says how many it got (see upstream()); the caller runs that many
+        personas at once.
+        """
+        async with self.admit(client_id, persona_ids):
+            async with self.upstream(max(1, len(persona_ids)) if persona_ids is not None else 1) as ticket:
+                yield ticket
+
+    @asynccontextmanager
+    async def admit(self, client_id: str, persona_ids: Optional[List[str]] = None):
+        """Client-side checks only: persona bound, in-flight cap and rate quota, without upstream slots.
+
+        For long-running work (scenarios) whose upstream calls each go through upstream().
+        """
+        if persona_ids is not None:
+            self.check_personas(persona_ids)
+
+        if self._client_in_flight.get(client_id, 0) >= self.client_max_in_flight:
+            self._reject(429, "Too many concurrent requests for this client", self._expected_wait())
+        self._take_client_token(client_id)
+
+        self._client_in_flight[client_id] = self._client_in_flight.get(client_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._client_in_flight[client_id] -= 1
+            if not self._client_in_flight[client_id]:
+                del self._client_in_flight[client_id]
+
+    @asynccontextmanager
+    async def upstream(self, calls: int = 1, background: bool = False):
+        """Hold slots for `calls` upstream calls and sample their latency.
+
+        The request is admitted as soon as one slot is free and is granted as many as
+        are free (at most `calls`), so a large fan-out does not wait for an idle worker;
+        it runs its calls in waves of `ticket.slots`. Latency samples are divided by the
+        number of waves so they stay per upstream call.
+        Background callers wait for a slot without a timeout and never count against
+        the interactive queue.
+        """
+        slots = await self._acquire(calls, background)
+        start = time.perf_counter()
+        ticket = Admission(slots)
+        try:
+            yield ticket
+        except Exception:
+            ticket.fail()
+            raise
+        finally:
+            self.limit.on_sample((time.perf_counter() - start) / math.ceil(calls / slots), not ticket.failed)
+            held = [future for future in ticket.held if not future.done()][:slots]
+            for future in held:
+                self._release_when_done(future)
+            await self._release(slots - len(held))
+
+    def open_connection(self):
+        if self.connections >= self.max_connections:
+            self._reject(503, "Too many open connections", self._expected_wait())
+        self.connections += 1
+
+    def close_connection(self):
+        self.connections -= 1
+
+    def stats(self):
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "stranded": self.stranded,
+            "waiting": self.waiting,
+            "background_waiting": self.background_waiting,
+            "connections": self.connections,
+            "rejected": self.rejected,
+            "baseline_latency": self.limit.baseline,
+            "recent_latency": self.limit.recent,
+        }
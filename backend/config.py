@@ -1,4 +1,4 @@
-import os
+from functools import lru_cache
 from typing import Optional
 from pydantic_settings import BaseSettings
 
@@ -14,6 +14,39 @@ class Settings(BaseSettings):
     # Google Gemini
     google_api_key: Optional[str] = None
     
+    # Semantic response cache
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.92
+    semantic_cache_max_entries: int = 1024
+    embedding_model: str = "text-embedding-3-small"
+    
+    # Admission control
+    admission_initial_concurrency: int = 8
+    admission_min_concurrency: int = 1
+    admission_max_concurrency: int = 64
+    admission_max_queue: int = 32
+    admission_queue_timeout: float = 5.0
+    max_persona_ids: int = 10
+    client_max_in_flight: int = 4
+    client_requests_per_minute: int = 60
+    max_websocket_connections: int = 200
+    trusted_proxies: str = ""  # comma-separated peer addresses whose X-Client-Id / ?client_id= is trusted
+    
+    # Stateless conversations (history resent each turn instead of previous_response_id)
+    stateless_mode: bool = False
+    context_token_budget: int = 4000
+    context_max_sessions: int = 1000
+    
+    # Scenario runner
+    scenario_checkpoint_dir: str = ".scenarios"
+    
+    # Deployment
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: int = 1
+    drain_timeout: float = 30.0
+    graceful_shutdown_timeout: float = 10.0  # uvicorn's own shutdown, after the drain
+    
     # App settings
     environment: str = "development"
     debug: bool = True
@@ -22,4 +55,15 @@ class Settings(BaseSettings):
         env_file = ".env"
         case_sensitive = False
 
-settings = Settings()
\ No newline at end of file
+@lru_cache()
+def get_settings() -> Settings:
+    """Read settings on first use rather than at import.
+
+    .env is first loaded into the process environment, searching upward from this
+    file as before, so variables the OpenAI SDK reads itself (OPENAI_BASE_URL,
+    OPENAI_ORG_ID, OPENAI_PROJECT_ID) keep working and the CWD does not matter.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Settings()
\ No newline at end of file
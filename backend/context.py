@@ -0,0 +1,174 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# Ceiling per model on the history we resend in stateless mode; CONTEXT_TOKEN_BUDGET can lower it
+MODEL_TOKEN_BUDGETS = {
+    "gpt-4o": 8000,
+    "gpt-4o-mini": 8000,
+}
+
+# What get_non_streaming_response returns instead of text when a call fails or produces nothing
+_FAILED_SUMMARIES = ("Error:", "No response generated")
+
+_encodings = {}
+
+def count_tokens(text, model="gpt-4o"):
+    """Count tokens locally with tiktoken when it is installed, else estimate at ~4 characters per token.
+
+    The first call per model may download the BPE file, so call this off the event loop.
+    """
+    if model not in _encodings:
+        try:
+            import tiktoken
+
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except ImportError:
+            _encodings[model] = None
+        except Exception as e:
+            # e.g. offline and the BPE file is not cached; estimate from now on rather than retry every call
+            print(f"Token encoding for {model} unavailable, estimating instead:", e)
+            _encodings[model] = None
+    encoding = _encodings[model]
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+class ContextAssembler:
+    """Builds token-budgeted input for sessions whose history is resent every turn.
+
+    The newest turns are sent verbatim while they fit the model's budget; older turns
+    are folded into a running summary that is produced in the background and cached
+    per session, so each turn is summarized at most once. Until a pending summary
+    lands, the request goes out with the previous summary and the recent window only.
+    """
+
+    def __init__(self, summarize_fn: Callable[[str], str], default_budget: int = 4000,
+                 max_sessions: int = 1000):
+        self.summarize_fn = summarize_fn
+        self.default_budget = default_budget
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def budget_for(self, model):
+        """The configured budget, capped by the model's own ceiling when it has one"""
+        return min(self.default_budget, MODEL_TOKEN_BUDGETS.get(model, self.default_budget))
+
+    def _session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = {"turns": [], "summary": "", "summary_tokens": 0, "summarized_upto": 0, "pending": None}
+            self._sessions[session_id] = session
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def has_history(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return bool(session and session["turns"])
+
+    def add_turn(self, session_id, role, content, model="gpt-4o"):
+        with self._lock:
+            self._session(session_id)["turns"].append(
+                {"role": role, "content": content, "tokens": count_tokens(content, model)}
+            )
+
+    def assemble(self, session_id, message, model="gpt-4o", instructions=None):
+        """Return (input items, report) for the next request in a session.
+
+        `instructions` (e.g. the persona) go out once as a leading system item rather
+        than being repeated in every stored turn.
+        """
+        budget = self.budget_for(model)
+        message_tokens = count_tokens(message, model)
+        if instructions:
+            message_tokens += count_tokens(instructions, model)
+
+        with self._lock:
+            session = self._session(session_id)
+            turns = session["turns"]
+            summary = session["summary"]
+            summary_tokens = session["summary_tokens"]
+            summarized_upto = session["summarized_upto"]
+
+            # Walk back from the newest turn until the window is full
+            available = budget - message_tokens - summary_tokens
+            start = len(turns)
+            while start > summarized_upto and turns[start - 1]["tokens"] <= available:
+                available -= turns[start - 1]["tokens"]
+                start -= 1
+
+            if start > summarized_upto:
+                # Fold everything but ~half a budget of recent turns, so the next few turns fit without another summary
+                cutoff, kept = len(turns), 0
+                while cutoff > summarized_upto and kept + turns[cutoff - 1]["tokens"] <= budget // 2:
+                    kept += turns[cutoff - 1]["tokens"]
+                    cutoff -= 1
+                self._schedule_summary(session_id, session, max(cutoff, start))
+
+            window = turns[start:]
+            summary_pending = session["pending"] is not None
+
+        items = []
+        if instructions:
+            items.append({"role": "system", "content": instructions})
+        if summary:
+            items.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        items.extend({"role": turn["role"], "content": turn["content"]} for turn in window)
+        items.append({"role": "user", "content": message})
+
+        history_tokens = sum(turn["tokens"] for turn in turns)
+        sent_tokens = summary_tokens + sum(turn["tokens"] for turn in window)
+        report = {
+            "budget": budget,
+            "history_tokens": history_tokens + message_tokens,
+            "sent_tokens": sent_tokens + message_tokens,
+            "tokens_saved": max(history_tokens - sent_tokens, 0),
+            "turns_in_window": len(window),
+            "turns_summarized": summarized_upto,
+            "summary_pending": summary_pending,
+        }
+        return items, report
+
+    def _schedule_summary(self, session_id, session, cutoff):
+        # Called with the lock held; at most one summary in flight per session
+        if session["pending"] is not None:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+
+        previous = session["summary"]
+        summarized_upto = session["summarized_upto"]
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in session["turns"][summarized_upto:cutoff])
+        prompt = (
+            "Update the running summary of a conversation. Keep names, facts, decisions and open questions; "
+            "drop pleasantries. Reply with the summary only.\n\n"
+            f"Current summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"
+        )
+        session["pending"] = self._executor.submit(self._summarize, session_id, session, prompt, cutoff)
+
+    def _summarize(self, session_id, session, prompt, cutoff):
+        try:
+            summary = self.summarize_fn(prompt)
+        except Exception as e:
+            print(f"Context summary failed for {session_id}:", e)
+            summary = None
+        with self._lock:
+            session["pending"] = None
+            if summary and not summary.startswith(_FAILED_SUMMARIES):
+                session["summary"] = summary
+                session["summary_tokens"] = count_tokens(summary)
+                session["summarized_upto"] = cutoff
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
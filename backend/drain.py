@@ -0,0 +1,88 @@
+import asyncio
+import signal
+import threading
+from typing import Awaitable, Callable, Optional, Set
+
+
+class DrainController:
+    """Tracks in-flight WebSocket streams and drains them before the worker exits.
+
+    Uvicorn closes every open WebSocket (code 1012) as soon as it starts shutting down,
+    which cuts persona replies off mid-stream. The signal handlers installed here run
+    first: they mark the worker as draining (not ready, new messages refused), give
+    active streams `timeout` seconds to finish, cancel whatever is left so each stream
+    can send its final aborted frame, and only then hand the signal on to uvicorn.
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self.ready = False
+        self.draining = False
+        self._streams: Set[asyncio.Task] = set()
+        self._drain_task: Optional[asyncio.Task] = None
+
+    @property
+    def active_streams(self):
+        return len(self._streams)
+
+    def track(self, task: asyncio.Task):
+        self._streams.add(task)
+        task.add_done_callback(self._streams.discard)
+        return task
+
+    async def drain(self):
+        """Wait for active streams up to the timeout, then cancel the stragglers"""
+        self.draining = True
+        self.ready = False
+        if not self._streams:
+            return
+        _, pending = await asyncio.wait(set(self._streams), timeout=self.timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Give cancelled streams a moment to flush their final frame
+            await asyncio.wait(pending, timeout=5.0)
+
+    def install_signal_handlers(self, before_exit: Callable[[], Awaitable[None]]):
+        """Drain on SIGTERM/SIGINT, then run `before_exit` and invoke the server's own handler.
+
+        A second signal during the drain skips straight to the server's handler.
+        Signal handlers can only be installed from the main thread, so this is a
+        no-op under test clients that run the app in a worker thread. Relies on
+        uvicorn >= 0.29, which captures signals with signal.signal; older releases
+        register them with loop.add_signal_handler, which bypasses this chain.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        loop = asyncio.get_running_loop()
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+
+            def hand_off(signum, frame, previous=previous):
+                if callable(previous):
+                    previous(signum, frame)
+                else:
+                    signal.signal(signum, previous)
+                    signal.raise_signal(signum)
+
+            async def drain_then_exit(signum, frame, hand_off=hand_off):
+                try:
+                    await self.drain()
+                    await before_exit()
+                finally:
+                    hand_off(signum, frame)
+
+            def handler(signum, frame, hand_off=hand_off, drain_then_exit=drain_then_exit):
+                if self.draining:
+                    hand_off(signum, frame)
+                    return
+                self.draining = True
+                self.ready = False
+                loop.call_soon_threadsafe(self._start_drain, drain_then_exit(signum, frame))
+
+            signal.signal(sig, handler)
+
+    def _start_drain(self, coroutine):
+        self._drain_task = asyncio.ensure_future(coroutine)
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Iterator, List, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+COMPLETED = "completed"
+TRUNCATED = "truncated"
+CANCELLED = "cancelled"
+ERROR = "error"
+
+# How long to wait for cancelled calls to notice their closed stream before reporting anyway
+CANCEL_GRACE = 2.0
+
+
+class PersonaCall:
+    """One persona's upstream stream, consumed on a worker thread and cancellable from the event loop"""
+
+    def __init__(self, persona_id: str, index: int):
+        self.persona_id = persona_id
+        self.index = index
+        self.text_parts: List[str] = []
+        self.response_id = ""
+        self.status: Optional[str] = None
+        self.detail: Optional[str] = None
+        self.cancelled = False
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def attach(self, stream):
+        """`on_stream` hook for stream_assistant_response; runs on the worker thread"""
+        with self._lock:
+            self._stream = stream
+            cancelled = self.cancelled
+        if cancelled:
+            stream.close()
+
+    def cancel(self):
+        """Close the upstream HTTP stream so generation (and token spend) stops"""
+        with self._lock:
+            self.cancelled = True
+            stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def consume(self, chunks: Iterator[str]):
+        try:
+            for chunk in chunks:
+                if self.cancelled:
+                    break
+                if chunk.startswith("__PRID:") and chunk.endswith("_PRID__"):
+                    self.response_id = chunk[7:-7]
+                elif chunk.startswith("__INCOMPLETE:"):
+                    self.status = TRUNCATED
+                    self.detail = chunk[len("__INCOMPLETE:"):-2]
+                elif chunk.startswith("__ERROR:"):
+                    self.status = ERROR
+                    self.detail = chunk
+                else:
+                    self.text_parts.append(chunk)
+        except Exception as e:
+            # A read interrupted by cancel() surfaces here as a connection error
+            if not self.cancelled:
+                self.status = ERROR
+                self.detail = str(e)
+        finally:
+            chunks.close()
+        if self.cancelled and self.status is None:
+            self.status = CANCELLED
+        elif self.status is None:
+            self.status = COMPLETED
+
+    def result(self):
+        result = {
+            "persona_id": self.persona_id,
+            "response": "".join(self.text_parts),
+            "response_id": self.response_id,
+            "status": self.status or CANCELLED,
+        }
+        if self.detail:
+            result["detail"] = self.detail
+        return result
+
+
+async def run_personas(persona_ids: List[str], make_stream: Callable[[PersonaCall], Iterator[str]],
+                       deadline: Optional[float] = None, quorum: Optional[int] = None,
+                       max_parallel: Optional[int] = None,
+                       on_result: Optional[Callable[[PersonaCall], Awaitable[None]]] = None,
+                       on_stranded: Optional[Callable[[Set[asyncio.Future]], None]] = None):
+    """Fan one message out to personas concurrently and stop early at a quorum or deadline.
+
+    `make_stream(call)` returns the persona's stream_assistant_response generator, with
+    `on_stream=call.attach` so the call can be cancelled mid-stream. Once `quorum`
+    personas have completed (or been truncated), or `deadline` seconds have passed, the
+    outstanding calls are cancelled and their partial text is reported as cancelled.
+    `on_result` is awaited as each persona finishes on its own. Calls still running
+    CANCEL_GRACE seconds after being cancelled are passed to `on_stranded` (e.g.
+    Admission.hold) so whoever accounts for them can wait for their threads.
+
+    Returns (results in persona order, summary).
+    """
+    calls = [PersonaCall(persona_id, index) for index, persona_id in enumerate(persona_ids)]
+    semaphore = asyncio.Semaphore(max_parallel or max(1, len(calls)))
+
+    async def run(call):
+        async with semaphore:
+            if not call.cancelled:
+                await run_in_threadpool(call.consume, make_stream(call))
+        return call
+
+    tasks = {asyncio.ensure_future(run(call)): call for call in calls}
+    pending = set(tasks)
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline if deadline else None
+    answered = 0
+    quorum_met = deadline_hit = False
+
+    try:
+        while pending:
+            timeout = None if end is None else max(end - loop.time(), 0)
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                deadline_hit = True
+                break
+            for task in done:
+                call = tasks[task]
+                if call.status in (COMPLETED, TRUNCATED):
+                    answered += 1
+                if on_result is not None:
+                    await on_result(call)
+            if quorum and answered >= quorum:
+                quorum_met = True
+                break
+    finally:
+        for task in pending:
+            tasks[task].cancel()
+        if pending:
+            # Calls stuck before their stream opened finish in the background; they are reported as cancelled
+            _, stranded = await asyncio.wait(pending, timeout=CANCEL_GRACE)
+            if stranded and on_stranded is not None:
+                on_stranded(stranded)
+
+    results = [call.result() for call in calls]
+    summary = {
+        status: [r["persona_id"] for r in results if r["status"] == status]
+        for status in (COMPLETED, TRUNCATED, CANCELLED, ERROR)
+    }
+    summary["quorum_met"] = quorum_met
+    summary["deadline_hit"] = deadline_hit
+    return results, summary
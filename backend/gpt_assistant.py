@@ -1,82 +1,188 @@
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import threading
+import time
+from config import get_settings
 
-# Load environment variables from .env
-load_dotenv()
+# Nothing here runs at import: the OpenAI SDK (the bulk of our import time), the client and
+# its HTTP connection pool, and the semantic cache (NumPy) are all built on first use.
+_client = None
+_semantic_cache = None
+_client_lock = threading.Lock()
 
-# Initialize OpenAI client
-API_KEY = os.getenv("OPENAI_API_KEY")
-if not API_KEY:
-    print("Warning: OPENAI_API_KEY not found in environment variables")
-    API_KEY = "your-api-key-here"  # Fallback for testing
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
 
-print("API key loaded:", API_KEY[:10] + "..." if API_KEY and len(API_KEY) > 10 else "Not found")
-client = OpenAI(api_key=API_KEY)
+                api_key = get_settings().openai_api_key
+                if not api_key:
+                    print("Warning: OPENAI_API_KEY not found in environment variables")
+                    api_key = "your-api-key-here"  # Fallback for testing
+                _client = OpenAI(api_key=api_key)
+    return _client
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def get_embedding(text):
+    return get_client().embeddings.create(model=get_settings().embedding_model, input=text).data[0].embedding
+
+def get_semantic_cache():
+    """Near-duplicate cache for first-turn persona replies (follow-ups depend on prior context, so they bypass it)"""
+    global _semantic_cache
+    if _semantic_cache is None:
+        with _client_lock:
+            if _semantic_cache is None:
+                from semantic_cache import SemanticCache
+
+                settings = get_settings()
+                _semantic_cache = SemanticCache(
+                    get_embedding,
+                    threshold=settings.semantic_cache_threshold,
+                    max_entries=settings.semantic_cache_max_entries,
+                )
+    return _semantic_cache
+
+def embed_for_cache(message):
+    """Embed a message once for several personas' cache lookups; None if the cache is off or embedding fails"""
+    if not get_settings().semantic_cache_enabled or not message:
+        return None
+    try:
+        return get_semantic_cache().embed(message)
+    except Exception as e:
+        print("Semantic cache embedding failed:", e)
+        return None
+
+def _cache_lookup(persona_id, message, prev_resp_id, vector=None):
+    """Return (cached entry or None, message embedding to reuse when storing the miss)"""
+    if not get_settings().semantic_cache_enabled or persona_id is None or not message or prev_resp_id:
+        return None, None
+    try:
+        cache = get_semantic_cache()
+        if vector is None:
+            vector = cache.embed(message)
+        return cache.lookup(persona_id, message, vector=vector), vector
+    except Exception as e:
+        print("Semantic cache lookup failed:", e)
+        return None, None
+
+def _cache_store(persona_id, message, prev_resp_id, response, latency, vector):
+    if not get_settings().semantic_cache_enabled or persona_id is None or not message or prev_resp_id:
+        return
+    try:
+        get_semantic_cache().store(persona_id, message, response, latency, vector=vector)
+    except Exception as e:
+        print("Semantic cache store failed:", e)
 
 # Input array could be an array or text, does not matter.
-def get_ai_resp(input_arr, stream=True, pr_id=None):
-    out = client.responses.create(
+def get_ai_resp(input_arr, stream=True, pr_id=None, store=None, max_output_tokens=None):
+    extra = {}
+    if store is not None:
+        # store=False keeps nothing server-side; the caller resends history itself (see context.py)
+        extra["store"] = store
+    if max_output_tokens is not None:
+        extra["max_output_tokens"] = max_output_tokens
+    out = get_client().responses.create(
         model="gpt-4o",
         input=input_arr,
         previous_response_id=pr_id,
         stream=stream,
-        #store=False
+        **extra
     )
     return out
 
-def stream_assistant_response(query=None, prev_resp_id=None):
-    ai_r = get_ai_resp(query, stream=True, pr_id=prev_resp_id)
+def stream_assistant_response(query=None, prev_resp_id=None, persona_id=None, message=None, store=None,
+                              max_output_tokens=None, on_stream=None, vector=None):
+    # A capped request must not be answered with an uncapped cached reply
+    cached, vector = (_cache_lookup(persona_id, message, prev_resp_id, vector) if max_output_tokens is None
+                      else (None, None))
+    if cached:
+        # No response id on a hit: the cached response belongs to another conversation
+        yield "__PRID:_PRID__"
+        yield cached["response"]
+        return
+
+    start = time.perf_counter()
+    ai_r = get_ai_resp(query, stream=True, pr_id=prev_resp_id, store=store, max_output_tokens=max_output_tokens)
+    if on_stream is not None:
+        # Hands the raw stream to the caller so it can be closed from another thread to cancel the call
+        on_stream(ai_r)
     resp_id = ""
     final_tool_calls = {}
+    text_parts = []
     
-    for event in ai_r:
-        event_type = event.type
-        
-        if event_type == "response.created":
-            # Print the response id for production logging.
-            response = getattr(event, "response", {})
-            resp_id = getattr(response, "id", "unknown")
-            yield f"__PRID:{resp_id}_PRID__"  # changing threadid to resp id to accommodate response api
-            # Continue to next event; do not yield anything to UI.
-            continue
-            
-        if event_type == "response.output_item.added":
-            # Extract the item from the event
-            item = event.item
-            # Compare the inner item's type
-            if hasattr(item, "type") and item.type == "function_call":
-                final_tool_calls[event.output_index] = item
-            else:
-                # Process non-function_call items if needed
-                print("Received non-function_call item:", item)
-            continue
-            
-        if (event_type == "response.output_text.delta"):
-            text_delta = getattr(event, "delta", "")
-            yield text_delta
-            continue
-            
-        if (event_type == "response.completed"):
-            break
+    try:
+        for event in ai_r:
+            event_type = event.type
             
-        # Process additional function call argument delta events
-        if event_type == "response.function_call_arguments.delta":
-            index = event.output_index
-            if index in final_tool_calls:
-                final_tool_calls[index].arguments += event.delta
+            if event_type == "response.created":
+                # Print the response id for production logging.
+                response = getattr(event, "response", {})
+                resp_id = getattr(response, "id", "unknown")
+                yield f"__PRID:{resp_id}_PRID__"  # changing threadid to resp id to accommodate response api
+                # Continue to next event; do not yield anything to UI.
+                continue
                 
-        if event_type == "error":
-            error_message = f"Error: {getattr(event, 'message', 'Unknown error')}"
-            error_code = getattr(event, 'code', 'Unknown code')
-            yield f"__ERROR:{error_code}__ {error_message}"
-            continue
+            if event_type == "response.output_item.added":
+                # Extract the item from the event
+                item = event.item
+                # Compare the inner item's type
+                if hasattr(item, "type") and item.type == "function_call":
+                    final_tool_calls[event.output_index] = item
+                else:
+                    # Process non-function_call items if needed
+                    print("Received non-function_call item:", item)
+                continue
+                
+            if (event_type == "response.output_text.delta"):
+                text_delta = getattr(event, "delta", "")
+                text_parts.append(text_delta)
+                yield text_delta
+                continue
+                
+            if (event_type == "response.completed"):
+                _cache_store(persona_id, message, prev_resp_id, "".join(text_parts),
+                             time.perf_counter() - start, vector)
+                break
+                
+            if (event_type == "response.incomplete"):
+                # e.g. max_output_tokens reached; the text so far is all there will be
+                details = getattr(getattr(event, "response", None), "incomplete_details", None)
+                yield f"__INCOMPLETE:{getattr(details, 'reason', None) or 'unknown'}__"
+                break
+                
+            # Process additional function call argument delta events
+            if event_type == "response.function_call_arguments.delta":
+                index = event.output_index
+                if index in final_tool_calls:
+                    final_tool_calls[index].arguments += event.delta
+                    
+            if event_type == "error":
+                error_message = f"Error: {getattr(event, 'message', 'Unknown error')}"
+                error_code = getattr(event, 'code', 'Unknown code')
+                yield f"__ERROR:{error_code}__ {error_message}"
+                continue
+    finally:
+        # Dropping the HTTP stream stops generation, so abandoned responses stop consuming tokens
+        ai_r.close()
 
-def get_non_streaming_response(query, prev_resp_id=None):
+def get_non_streaming_response(query, prev_resp_id=None, persona_id=None, message=None, store=None):
     """Non-streaming version for simple responses"""
     try:
-        response = get_ai_resp(query, stream=False, pr_id=prev_resp_id)
+        cached, vector = _cache_lookup(persona_id, message, prev_resp_id)
+        if cached:
+            return cached["response"]
+
+        start = time.perf_counter()
+        response = get_ai_resp(query, stream=False, pr_id=prev_resp_id, store=store)
         if response.output and len(response.output) > 0:
+            _cache_store(persona_id, message, prev_resp_id, response.output_text,
+                         time.perf_counter() - start, vector)
             return response.output_text
         return "No response generated"
     except Exception as e:
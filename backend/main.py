@@ -1,14 +1,43 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Dict, Any, Optional
-import uvicorn
+from contextlib import asynccontextmanager
+from functools import lru_cache
 import json
 import asyncio
-from gpt_assistant import stream_assistant_response, get_non_streaming_response
+import os
+import uuid
+from gpt_assistant import (stream_assistant_response, get_non_streaming_response, get_semantic_cache, get_client,
+                           close_client, embed_for_cache)
+from admission import AdmissionController, AdmissionRejected
+from drain import DrainController
+from context import ContextAssembler
+from fanout import run_personas
+from scenario import ScenarioRunner, ScenarioRunning
+from config import get_settings
 import time
 
-app = FastAPI(title="Persona Simulator API", version="1.0.0")
+# Per-worker singletons are built on first use, so importing main reads no settings or environment
+
+@lru_cache()
+def get_drain() -> DrainController:
+    return DrainController(timeout=get_settings().drain_timeout)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    drain = get_drain()
+    drain.install_signal_handlers(lambda: manager.close_all(code=1001, reason="Server shutting down"))
+    drain.ready = True
+    # Warm the per-worker OpenAI client off the event loop so readiness is not held back by the SDK import
+    asyncio.get_running_loop().run_in_executor(None, get_client)
+    yield
+    drain.ready = False
+    close_client()
+
+app = FastAPI(title="Persona Simulator API", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -19,6 +48,90 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@lru_cache()
+def get_admission() -> AdmissionController:
+    settings = get_settings()
+    return AdmissionController(
+        initial_concurrency=settings.admission_initial_concurrency,
+        min_concurrency=settings.admission_min_concurrency,
+        max_concurrency=settings.admission_max_concurrency,
+        max_queue=settings.admission_max_queue,
+        queue_timeout=settings.admission_queue_timeout,
+        max_persona_ids=settings.max_persona_ids,
+        client_max_in_flight=settings.client_max_in_flight,
+        client_requests_per_minute=settings.client_requests_per_minute,
+        max_connections=settings.max_websocket_connections,
+    )
+
+@lru_cache()
+def get_context_assembler() -> ContextAssembler:
+    settings = get_settings()
+    return ContextAssembler(
+        lambda prompt: get_non_streaming_response(prompt, store=False),
+        default_budget=settings.context_token_budget,
+        max_sessions=settings.context_max_sessions,
+    )
+
+def assemble_context(request_data: dict, prompt: str, message: Optional[str] = None,
+                     instructions: Optional[str] = None):
+    """In stateless mode, build the request input from the session's budgeted history.
+
+    The history holds bare `message`s with `instructions` sent once up front; `prompt`
+    (both combined) is what goes out outside stateless mode or without a session. The
+    budget follows the request's "model" (default gpt-4o). Returns (input, context
+    report or None). Counting tokens can load an encoding, so call it off the event loop.
+    """
+    if not request_data.get("stateless", get_settings().stateless_mode):
+        return prompt, None
+    session_id = request_data.get("session_id")
+    if not session_id:
+        return prompt, {"tokens_saved": 0, "history_tokens": 0}
+    return get_context_assembler().assemble(
+        session_id, prompt if message is None else message, request_data.get("model") or "gpt-4o", instructions
+    )
+
+async def persona_stream_factory(message: str, max_output_tokens: Optional[int] = None):
+    """make_stream for run_personas: one cancellable persona stream per call"""
+    # The cache key does not depend on the persona, so embed the message once for the whole fan-out
+    vector = await run_in_threadpool(embed_for_cache, message) if max_output_tokens is None else None
+
+    def make_stream(call):
+        prompt = f"You are {call.persona_id}, a unique persona with distinct characteristics. Respond in character to this message: {message}"
+        return stream_assistant_response(
+            prompt, persona_id=call.persona_id, message=message,
+            max_output_tokens=max_output_tokens, on_stream=call.attach, vector=vector,
+        )
+    return make_stream
+
+def scenario_turn_stream(call, turn: str, previous_response_id: Optional[str]):
+    """make_stream for ScenarioRunner: one turn of a persona's chain"""
+    prompt = f"You are {call.persona_id}, a unique persona with distinct characteristics. Respond in character to this message: {turn}"
+    # No semantic cache: a cached reply has no response id, and every turn must chain from a real one
+    return stream_assistant_response(prompt, previous_response_id, on_stream=call.attach)
+
+@lru_cache()
+def get_scenario_runner() -> ScenarioRunner:
+    return ScenarioRunner(
+        scenario_turn_stream,
+        get_admission(),
+        checkpoint_dir=get_settings().scenario_checkpoint_dir,
+    )
+
+def get_client_id(connection) -> str:
+    """Identify the caller for per-client quotas.
+
+    Quotas are keyed on the peer address. A client-chosen id (X-Client-Id header, or
+    ?client_id= on WebSockets) is only honoured from a TRUSTED_PROXIES peer, since
+    anyone else could dodge their quota by sending a fresh id each time.
+    """
+    peer = connection.client.host if connection.client else "unknown"
+    trusted = {address.strip() for address in get_settings().trusted_proxies.split(",") if address.strip()}
+    if peer in trusted:
+        client_id = connection.headers.get("x-client-id") or connection.query_params.get("client_id")
+        if client_id:
+            return client_id
+    return peer
+
 # Pydantic models
 class ChatMessage(BaseModel):
     message: str
@@ -29,13 +142,24 @@ class ChatResponse(BaseModel):
     response: str
     persona_id: str
 
-class MultiChatMessage(BaseModel):
+class FanoutOptions(BaseModel):
+    deadline: Optional[float] = Field(None, gt=0)  # seconds; outstanding personas are cancelled when it passes
+    quorum: Optional[int] = Field(None, ge=1)  # return once this many personas have answered
+    max_output_tokens: Optional[int] = Field(None, ge=16)  # per-persona cap (the API minimum)
+
+class MultiChatMessage(FanoutOptions):
     message: str
     persona_ids: List[str]
     model: Optional[str] = "gpt-4o-mini"
 
 class MultiChatResponse(BaseModel):
     responses: List[Dict[str, str]]
+    completed: List[str] = []
+    truncated: List[str] = []
+    cancelled: List[str] = []
+    error: List[str] = []
+    quorum_met: bool = False
+    deadline_hit: bool = False
 
 class OpenAIChatRequest(BaseModel):
     input_text: str
@@ -52,55 +176,101 @@ class WebSocketMessage(BaseModel):
 async def root():
     return {"message": "Persona Simulator API is running"}
 
+@app.get("/healthz")
+async def liveness():
+    """Liveness probe: the worker's event loop is responsive"""
+    return {"status": "alive", "pid": os.getpid()}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: startup finished and the worker is not draining"""
+    drain = get_drain()
+    body = {
+        "status": "ready" if drain.ready else ("draining" if drain.draining else "starting"),
+        "pid": os.getpid(),
+        "active_streams": drain.active_streams,
+        "connections": len(manager.active_connections),
+    }
+    return JSONResponse(body, status_code=200 if drain.ready else 503)
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(chat_message: ChatMessage):
+async def chat_endpoint(chat_message: ChatMessage, request: Request):
     """Single persona chat endpoint"""
     try:
         persona_id = chat_message.persona_id
         prompt = f"You are {persona_id}, a unique persona with distinct characteristics. Respond in character to this message: {chat_message.message}"
         
-        response_text = get_non_streaming_response(prompt)
+        async with get_admission().request(get_client_id(request)) as ticket:
+            response_text = await run_in_threadpool(
+                get_non_streaming_response, prompt, persona_id=persona_id, message=chat_message.message
+            )
+            if response_text.startswith("Error:"):
+                ticket.fail()
         
         return ChatResponse(
             response=response_text,
             persona_id=persona_id
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/multi", response_model=MultiChatResponse)
-async def multi_chat_endpoint(multi_message: MultiChatMessage):
+async def multi_chat_endpoint(multi_message: MultiChatMessage, request: Request):
     """Multi-persona chat endpoint"""
     try:
-        responses = []
+        async with get_admission().request(get_client_id(request), multi_message.persona_ids) as ticket:
+            responses, summary = await run_personas(
+                multi_message.persona_ids,
+                await persona_stream_factory(multi_message.message, multi_message.max_output_tokens),
+                deadline=multi_message.deadline,
+                quorum=multi_message.quorum,
+                max_parallel=ticket.slots,
+                on_stranded=ticket.hold,
+            )
+            if summary["error"]:
+                ticket.fail()
         
-        for persona_id in multi_message.persona_ids:
-            prompt = f"You are {persona_id}, a unique persona with distinct characteristics. Respond in character to this message: {multi_message.message}"
-            response_text = get_non_streaming_response(prompt)
-            
-            responses.append({
-                "persona_id": persona_id,
-                "response": response_text
-            })
-        
-        return MultiChatResponse(responses=responses)
+        return MultiChatResponse(responses=responses, **summary)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/openai-chat")
-async def openai_chat_endpoint(request: OpenAIChatRequest):
+async def openai_chat_endpoint(request: OpenAIChatRequest, http_request: Request):
     """Direct OpenAI chat endpoint"""
     try:
-        response_text = get_non_streaming_response(request.input_text)
+        async with get_admission().request(get_client_id(http_request)) as ticket:
+            response_text = await run_in_threadpool(get_non_streaming_response, request.input_text)
+            if response_text.startswith("Error:"):
+                ticket.fail()
         
         return {
             "response": response_text,
             "model": request.model or "gpt-4o"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    """Semantic response cache hit rate and latency saved"""
+    return get_semantic_cache().stats()
+
+@app.get("/admission/stats")
+async def admission_stats_endpoint():
+    """Current adaptive concurrency limit, queue depth and rejection count"""
+    return get_admission().stats()
+
 # WebSocket connection manager
+class ClientGone(Exception):
+    """The WebSocket peer went away mid-request; not an upstream failure"""
+
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
@@ -110,15 +280,36 @@ class ConnectionManager:
         self.active_connections.append(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
 
     async def send_message(self, websocket: WebSocket, message: dict):
-        await websocket.send_text(json.dumps(message))
+        try:
+            await websocket.send_text(json.dumps(message))
+        except Exception as e:
+            raise ClientGone() from e
+
+    async def send_aborted(self, websocket: WebSocket, persona_id: Optional[str] = None):
+        """Final frame for a stream cut short by a server drain"""
+        message = {"type": "chunk", "chunk": "", "is_final": True, "aborted": True, "reason": "server_shutdown"}
+        if persona_id is not None:
+            message["persona_id"] = persona_id
+        try:
+            await self.send_message(websocket, message)
+        except Exception:
+            pass
+
+    async def close_all(self, code: int = 1000, reason: str = ""):
+        for websocket in list(self.active_connections):
+            try:
+                await websocket.close(code=code, reason=reason)
+            except Exception:
+                pass
 
 manager = ConnectionManager()
 
 async def stream_openai_response(websocket: WebSocket, request_data: dict):
-    """Stream OpenAI API response with status updates"""
+    """Stream OpenAI API response with status updates; returns False if the upstream call failed"""
     try:
         await manager.send_message(websocket, {
             "type": "status",
@@ -128,6 +319,10 @@ async def stream_openai_response(websocket: WebSocket, request_data: dict):
         
         input_text = request_data.get("input_text", "")
         prev_resp_id = request_data.get("previous_response_id")
+        session_id = request_data.get("session_id")
+        query, context_report = await run_in_threadpool(assemble_context, request_data, input_text)
+        if context_report is not None:
+            prev_resp_id = None
         
         await manager.send_message(websocket, {
             "type": "status", 
@@ -145,18 +340,23 @@ async def stream_openai_response(websocket: WebSocket, request_data: dict):
         full_response = ""
         response_id = ""
         
-        for chunk in stream_assistant_response(input_text, prev_resp_id):
+        async for chunk in iterate_in_threadpool(
+            stream_assistant_response(query, prev_resp_id, store=False if context_report is not None else None)
+        ):
             if chunk.startswith("__PRID:") and chunk.endswith("_PRID__"):
                 # Extract response ID
                 response_id = chunk[7:-7]  # Remove __PRID: and _PRID__
                 continue
+            elif chunk.startswith("__INCOMPLETE:"):
+                # Response stopped early (e.g. content filter); keep what was streamed
+                continue
             elif chunk.startswith("__ERROR:"):
                 await manager.send_message(websocket, {
                     "type": "error",
                     "status": "error",
                     "message": chunk
                 })
-                return
+                return False
             else:
                 # Regular text chunk
                 full_response += chunk
@@ -178,25 +378,42 @@ async def stream_openai_response(websocket: WebSocket, request_data: dict):
             "is_final": True
         })
         
+        data = {
+            "response": full_response, 
+            "model": "gpt-4o",
+            "response_id": response_id
+        }
+        if context_report is not None:
+            data["context"] = context_report
+            if session_id:
+                model = request_data.get("model") or "gpt-4o"
+                get_context_assembler().add_turn(session_id, "user", input_text, model)
+                get_context_assembler().add_turn(session_id, "assistant", full_response, model)
+        
         await manager.send_message(websocket, {
             "type": "response",
             "status": "completed",
-            "data": {
-                "response": full_response, 
-                "model": "gpt-4o",
-                "response_id": response_id
-            }
+            "data": data
         })
+        return True
         
+    except asyncio.CancelledError:
+        await manager.send_aborted(websocket)
+        raise
+    except ClientGone:
+        raise
     except Exception as e:
         await manager.send_message(websocket, {
             "type": "error",
             "status": "error",
             "message": str(e)
         })
+        return False
 
 async def stream_chat_response(websocket: WebSocket, request_data: dict):
-    """Stream persona chat response"""
+    """Stream persona chat response; returns False if the upstream call failed"""
+    # Read before the first await so the cancellation handler can always name the persona
+    persona_id = request_data.get("persona_id", "default")
     try:
         await manager.send_message(websocket, {
             "type": "status",
@@ -205,10 +422,21 @@ async def stream_chat_response(websocket: WebSocket, request_data: dict):
         })
         
         message = request_data.get("message", "")
-        persona_id = request_data.get("persona_id", "default")
         prev_resp_id = request_data.get("previous_response_id")
         
         prompt = f"You are {persona_id}, a unique persona with distinct characteristics. Respond in character to this message: {message}"
+        instructions = f"You are {persona_id}, a unique persona with distinct characteristics. Respond in character to the user's messages."
+        
+        session_id = request_data.get("session_id")
+        # Only a first turn may be answered from the semantic cache
+        cache_key = {"persona_id": persona_id, "message": message}
+        if session_id and get_context_assembler().has_history(session_id):
+            cache_key = {}
+        query, context_report = await run_in_threadpool(
+            assemble_context, request_data, prompt, message=message, instructions=instructions
+        )
+        if context_report is not None:
+            prev_resp_id = None
         
         await manager.send_message(websocket, {
             "type": "status",
@@ -220,18 +448,25 @@ async def stream_chat_response(websocket: WebSocket, request_data: dict):
         full_response = ""
         response_id = ""
         
-        for chunk in stream_assistant_response(prompt, prev_resp_id):
+        async for chunk in iterate_in_threadpool(
+            stream_assistant_response(
+                query, prev_resp_id, store=False if context_report is not None else None, **cache_key
+            )
+        ):
             if chunk.startswith("__PRID:") and chunk.endswith("_PRID__"):
                 # Extract response ID
                 response_id = chunk[7:-7]  # Remove __PRID: and _PRID__
                 continue
+            elif chunk.startswith("__INCOMPLETE:"):
+                # Response stopped early (e.g. content filter); keep what was streamed
+                continue
             elif chunk.startswith("__ERROR:"):
                 await manager.send_message(websocket, {
                     "type": "error",
                     "status": "error",
                     "message": chunk
                 })
-                return
+                return False
             else:
                 # Regular text chunk - break into individual characters for smooth streaming
                 full_response += chunk
@@ -255,25 +490,49 @@ async def stream_chat_response(websocket: WebSocket, request_data: dict):
             "is_final": True
         })
         
+        data = {
+            "response": full_response, 
+            "persona_id": persona_id,
+            "response_id": response_id
+        }
+        if context_report is not None:
+            data["context"] = context_report
+            if session_id:
+                model = request_data.get("model") or "gpt-4o"
+                get_context_assembler().add_turn(session_id, "user", message, model)
+                get_context_assembler().add_turn(session_id, "assistant", full_response, model)
+        
         await manager.send_message(websocket, {
             "type": "response",
             "status": "completed",
-            "data": {
-                "response": full_response, 
-                "persona_id": persona_id,
-                "response_id": response_id
-            }
+            "data": data
         })
+        return True
         
+    except asyncio.CancelledError:
+        await manager.send_aborted(websocket, persona_id)
+        raise
+    except ClientGone:
+        raise
     except Exception as e:
         await manager.send_message(websocket, {
             "type": "error",
             "status": "error", 
             "message": str(e)
         })
+        return False
 
-async def stream_multi_chat_response(websocket: WebSocket, request_data: dict):
-    """Stream multi-persona chat responses"""
+async def stream_multi_chat_response(websocket: WebSocket, request_data: dict, ticket=None):
+    """Stream multi-persona chat responses; returns False if any persona's upstream call failed"""
+    try:
+        options = FanoutOptions.model_validate(request_data)
+    except ValidationError as e:
+        await manager.send_message(websocket, {
+            "type": "error",
+            "status": "error",
+            "message": str(e)
+        })
+        return None
     try:
         await manager.send_message(websocket, {
             "type": "status",
@@ -284,55 +543,119 @@ async def stream_multi_chat_response(websocket: WebSocket, request_data: dict):
         message = request_data.get("message", "")
         persona_ids = request_data.get("persona_ids", [])
         
-        responses = []
+        await manager.send_message(websocket, {
+            "type": "status",
+            "status": "processing",
+            "message": f"Getting responses from {len(persona_ids)} personas..."
+        })
         
-        for i, persona_id in enumerate(persona_ids):
-            await manager.send_message(websocket, {
-                "type": "status",
-                "status": "processing",
-                "message": f"Getting response from {persona_id} ({i+1}/{len(persona_ids)})..."
-            })
-            
-            prompt = f"You are {persona_id}, a unique persona with distinct characteristics. Respond in character to this message: {message}"
-            
-            # Stream each persona response
-            full_response = ""
-            response_id = ""
+        async def send_persona_response(call):
+            result = call.result()
+            if result["status"] == "error":
+                await manager.send_message(websocket, {
+                    "type": "error",
+                    "status": "error",
+                    "message": f"{call.persona_id}: {result.get('detail', '')}"
+                })
+            await manager.send_message(websocket, dict(result, type="persona_response", index=call.index))
+        
+        # Personas answer concurrently, each sent as soon as it finishes
+        responses, summary = await run_personas(
+            persona_ids,
+            await persona_stream_factory(message, options.max_output_tokens),
+            deadline=options.deadline,
+            quorum=options.quorum,
+            max_parallel=ticket.slots if ticket else None,
+            on_result=send_persona_response,
+            on_stranded=ticket.hold if ticket else None,
+        )
+        
+        # Whatever was gathered before the quorum/deadline cut-off, including partial text
+        for index, result in enumerate(responses):
+            if result["status"] == "cancelled":
+                await manager.send_message(websocket, dict(result, type="persona_response", index=index))
+        
+        await manager.send_message(websocket, {
+            "type": "response",
+            "status": "completed",
+            "data": dict(summary, responses=responses)
+        })
+        return not summary["error"]
+        
+    except asyncio.CancelledError:
+        await manager.send_aborted(websocket)
+        raise
+    except ClientGone:
+        raise
+    except Exception as e:
+        await manager.send_message(websocket, {
+            "type": "error",
+            "status": "error",
+            "message": str(e)
+        })
+        return False
+
+async def stream_scenario_response(websocket: WebSocket, request_data: dict):
+    """Run or resume a scripted multi-turn scenario across personas, streaming per-persona progress"""
+    try:
+        runner = get_scenario_runner()
+        # New scenarios get their id up front so they are claimed the same way as resumes
+        scenario_id = request_data.get("scenario_id") or uuid.uuid4().hex
+        with runner.claim(scenario_id):
+            state = runner.load(scenario_id)
+            resumed = state is not None
             
-            for chunk in stream_assistant_response(prompt):
-                if chunk.startswith("__PRID:") and chunk.endswith("_PRID__"):
-                    response_id = chunk[7:-7]
-                    continue
-                elif chunk.startswith("__ERROR:"):
+            if state is None:
+                turns = request_data.get("turns", [])
+                persona_ids = request_data.get("persona_ids", [])
+                if not turns or not persona_ids:
                     await manager.send_message(websocket, {
                         "type": "error",
                         "status": "error",
-                        "message": f"{persona_id}: {chunk}"
+                        "message": "A new scenario needs non-empty turns and persona_ids"
                     })
-                    continue
-                else:
-                    full_response += chunk
+                    return
+                state = runner.new_state(turns, persona_ids, scenario_id)
+            else:
+                try:
+                    # A resume names only the scenario; bound the personas stored in its checkpoint
+                    get_admission().check_personas(state["persona_ids"])
+                except AdmissionRejected as e:
+                    await manager.send_message(websocket, e.to_message())
+                    return
             
+            remaining = sum(len(state["turns"]) - p["completed_turns"] for p in state["personas"].values())
             await manager.send_message(websocket, {
-                "type": "persona_response",
-                "persona_id": persona_id,
-                "response": full_response,
-                "response_id": response_id,
-                "index": i
+                "type": "status",
+                "status": "starting",
+                "scenario_id": state["scenario_id"],
+                "resumed": resumed,
+                "message": f"{'Resuming' if resumed else 'Starting'} scenario {state['scenario_id']}: "
+                           f"{len(state['persona_ids'])} personas, {remaining} turns to run..."
             })
             
-            responses.append({
-                "persona_id": persona_id,
-                "response": full_response,
-                "response_id": response_id
+            async def send_progress(event):
+                await manager.send_message(websocket, dict(event, type="scenario_progress"))
+            
+            state = await runner.run(state, on_progress=send_progress)
+            
+            await manager.send_message(websocket, {
+                "type": "response",
+                "status": state["status"],
+                "data": state
             })
         
+    except ScenarioRunning as e:
         await manager.send_message(websocket, {
-            "type": "response",
-            "status": "completed",
-            "data": {"responses": responses}
+            "type": "error",
+            "status": "already_running",
+            "message": str(e)
         })
-        
+    except asyncio.CancelledError:
+        await manager.send_aborted(websocket)
+        raise
+    except ClientGone:
+        raise
     except Exception as e:
         await manager.send_message(websocket, {
             "type": "error",
@@ -343,6 +666,18 @@ async def stream_multi_chat_response(websocket: WebSocket, request_data: dict):
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time communication"""
+    client_id = get_client_id(websocket)
+    admission = get_admission()
+    drain = get_drain()
+    try:
+        admission.open_connection()
+    except AdmissionRejected as e:
+        # Accept first so the client receives the Retry-After hint before the close
+        await websocket.accept()
+        await manager.send_message(websocket, e.to_message())
+        await websocket.close(code=1013)
+        return
+    
     await manager.connect(websocket)
     
     try:
@@ -354,28 +689,93 @@ async def websocket_endpoint(websocket: WebSocket):
             message_type = message.get("type")
             request_data = message.get("data", {})
             
-            if message_type == "openai_chat":
-                await stream_openai_response(websocket, request_data)
-            elif message_type == "chat":
-                await stream_chat_response(websocket, request_data)
-            elif message_type == "multi_chat":
-                await stream_multi_chat_response(websocket, request_data)
-            else:
+            handlers = {
+                "openai_chat": stream_openai_response,
+                "chat": stream_chat_response,
+                "multi_chat": stream_multi_chat_response,
+                "scenario": stream_scenario_response,
+            }
+            if drain.draining:
+                await manager.send_message(websocket, {
+                    "type": "error",
+                    "status": "draining",
+                    "retry_after": 1,
+                    "message": "Server is shutting down, reconnect to another worker"
+                })
+                continue
+            
+            if message_type not in handlers:
                 await manager.send_message(websocket, {
                     "type": "error",
                     "status": "error",
                     "message": f"Unsupported message type: {message_type}"
                 })
+                continue
+            
+            persona_ids = request_data.get("persona_ids", []) if message_type in ("multi_chat", "scenario") else None
+            if message_type == "scenario":
+                # Client quotas only: the runner takes an upstream slot per turn
+                admitted = admission.admit(client_id, persona_ids)
+            else:
+                admitted = admission.request(client_id, persona_ids)
+            try:
+                async with admitted as ticket:
+                    if message_type == "multi_chat":
+                        coroutine = stream_multi_chat_response(websocket, request_data, ticket=ticket)
+                    else:
+                        coroutine = handlers[message_type](websocket, request_data)
+                    # Run as a tracked task so a drain can wait for it or cancel it on its own
+                    task = drain.track(asyncio.create_task(coroutine))
+                    try:
+                        await asyncio.wait({task})
+                    finally:
+                        if not task.done():
+                            task.cancel()
+                    # Handlers report upstream failures by returning False; a client that left is not one
+                    if ticket is not None and not task.cancelled():
+                        error = task.exception()
+                        if (error is None and task.result() is False) or (
+                                error is not None and not isinstance(error, ClientGone)):
+                            ticket.fail()
+            except AdmissionRejected as e:
+                await manager.send_message(websocket, e.to_message())
+                continue
+            
+            if task.cancelled():
+                # Aborted by the drain; the handler already sent its final frame
+                manager.disconnect(websocket)
+                try:
+                    await websocket.close(code=1001, reason="Server shutting down")
+                except Exception:
+                    pass
+                return
+            task.result()
                 
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
+    except (WebSocketDisconnect, ClientGone):
+        pass
     except Exception as e:
-        await manager.send_message(websocket, {
-            "type": "error", 
-            "status": "error",
-            "message": f"WebSocket error: {str(e)}"
-        })
+        try:
+            await manager.send_message(websocket, {
+                "type": "error", 
+                "status": "error",
+                "message": f"WebSocket error: {str(e)}"
+            })
+        except ClientGone:
+            pass
+    finally:
         manager.disconnect(websocket)
+        admission.close_connection()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    import uvicorn
+
+    settings = get_settings()
+    # Production launch: WORKERS processes, each draining its streams before uvicorn's own shutdown.
+    # The graceful-shutdown timeout only has to cover what is left after the drain closed the sockets.
+    uvicorn.run(
+        "main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+        timeout_graceful_shutdown=settings.graceful_shutdown_timeout,
+    )
\ No newline at end of file
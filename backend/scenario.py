@@ -0,0 +1,251 @@
+import asyncio
+import json
+import os
+import re
+import socket
+import uuid
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from admission import AdmissionController
+from fanout import COMPLETED, TRUNCATED, PersonaCall
+
+_SCENARIO_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class ScenarioRunning(Exception):
+    """Raised when a scenario id is already being run by this or another worker"""
+
+
+def _process_started(pid) -> Optional[str]:
+    """Start time of a process in clock ticks since boot (Linux), to tell a live owner from a reused pid"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the parenthesised command name; starttime is field 22 overall
+            return f.read().rpartition(")")[2].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+class ScenarioRunner:
+    """Runs scripted multi-turn scenarios across an audience of personas.
+
+    Each persona walks the turns on its own chain of previous_response_ids, so there
+    is no barrier between turns: persona A can be on turn 3 while persona B is still
+    on turn 1. Every turn takes one upstream slot from the worker's admission
+    controller, so scenarios share the adaptive limit (and feed it one latency
+    sample per turn) with interactive traffic. State is checkpointed to a JSON file after every completed turn;
+    running a scenario again with the same id resumes each persona after its last
+    completed turn.
+    """
+
+    def __init__(self, make_stream: Callable[[PersonaCall, str, Optional[str]], Iterator[str]],
+                 admission: AdmissionController, checkpoint_dir: str = ".scenarios"):
+        self.make_stream = make_stream
+        self.admission = admission
+        self.checkpoint_dir = checkpoint_dir
+        self._save_locks: Dict[str, asyncio.Lock] = {}
+
+    def _path(self, scenario_id):
+        if not _SCENARIO_ID.match(scenario_id):
+            raise ValueError(f"Invalid scenario_id: {scenario_id!r}")
+        return os.path.join(self.checkpoint_dir, f"{scenario_id}.json")
+
+    @contextmanager
+    def claim(self, scenario_id):
+        """Hold an exclusive lock file on a scenario id for the duration of a run.
+
+        The lock is shared by every worker using the checkpoint directory, so two
+        connections can never run (and checkpoint) the same scenario at once. It
+        records the owner's host, pid and process start time; a lock whose owner on
+        this host is gone (or whose pid now belongs to a newer process) is taken over.
+        """
+        path = self._path(scenario_id) + ".lock"
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        token = uuid.uuid4().hex
+        owner = {"host": socket.gethostname(), "pid": os.getpid(), "started": _process_started(os.getpid()),
+                 "token": token}
+
+        # Write the lock under a unique name, then link it into place: the link is atomic
+        # and fails if a lock exists, so the lock is never seen half-written
+        tmp = f"{path}.{token}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(owner, f)
+        try:
+            for attempt in range(2):
+                try:
+                    os.link(tmp, path)
+                    break
+                except FileExistsError:
+                    if attempt or not self._take_over_stale(path, token):
+                        raise ScenarioRunning(f"Scenario {scenario_id} is already running")
+        finally:
+            os.remove(tmp)
+
+        try:
+            yield
+        finally:
+            if self._read_lock(path).get("token") == token:
+                os.remove(path)
+
+    @staticmethod
+    def _read_lock(path) -> dict:
+        try:
+            with open(path) as f:
+                lock = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            lock = None
+        # Anything else is not a lock this code wrote, and nobody can prove ownership of it
+        return lock if isinstance(lock, dict) else {"stale": True}
+
+    def _take_over_stale(self, path, token):
+        """Move a stale lock out of the way; True if the caller may try to take the lock again"""
+        lock = self._read_lock(path)
+        if not lock:
+            return True
+        if not lock.get("stale"):
+            if lock.get("host") != socket.gethostname():
+                # Cannot inspect another host's processes
+                return False
+            try:
+                os.kill(lock["pid"], 0)
+                alive = True
+            except ProcessLookupError:
+                alive = False
+            except PermissionError:
+                alive = True
+            started = _process_started(lock["pid"])
+            if alive and (started is None or started == lock.get("started")):
+                return False
+
+        # Claim the stale file by renaming it to a name only we use. The rename is atomic,
+        # so of two workers taking over at once only one gets it; and if a fresh lock
+        # replaced the stale one since we read it, put it back and give up.
+        grabbed = f"{path}.{token}.stale"
+        try:
+            os.replace(path, grabbed)
+        except FileNotFoundError:
+            return True
+        if self._read_lock(grabbed) != lock:
+            try:
+                os.link(grabbed, path)
+            except FileExistsError:
+                pass
+            os.remove(grabbed)
+            return False
+        os.remove(grabbed)
+        return True
+
+    def load(self, scenario_id) -> Optional[dict]:
+        try:
+            with open(self._path(scenario_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, state):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self._path(state["scenario_id"])
+        # Write-then-rename so an interrupted write never leaves a corrupt checkpoint
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    async def _save(self, state):
+        """Checkpoint off the event loop, one write at a time per scenario"""
+        # Personas keep advancing while the write runs, so serialize a snapshot; recorded
+        # responses are never mutated, so copying the containers is enough
+        snapshot = dict(state, personas={
+            persona_id: dict(progress, responses=list(progress["responses"]))
+            for persona_id, progress in state["personas"].items()
+        })
+        lock = self._save_locks.setdefault(state["scenario_id"], asyncio.Lock())
+        async with lock:
+            await run_in_threadpool(self._write, snapshot)
+
+    def new_state(self, turns: List[str], persona_ids: List[str], scenario_id: Optional[str] = None):
+        scenario_id = scenario_id or uuid.uuid4().hex
+        self._path(scenario_id)
+        persona_ids = list(dict.fromkeys(persona_ids))
+        return {
+            "scenario_id": scenario_id,
+            "status": "pending",
+            "turns": turns,
+            "persona_ids": persona_ids,
+            "personas": {
+                persona_id: {"completed_turns": 0, "previous_response_id": None, "responses": []}
+                for persona_id in persona_ids
+            },
+        }
+
+    async def run(self, state: dict, on_progress: Optional[Callable[[dict], Awaitable[None]]] = None):
+        """Run every persona's remaining turns; returns the final state. Call it under claim()."""
+        state["status"] = "running"
+        await self._save(state)
+
+        try:
+            await asyncio.gather(*(
+                self._run_persona(state, persona_id, on_progress) for persona_id in state["persona_ids"]
+            ))
+
+            finished = all(p["completed_turns"] == len(state["turns"]) for p in state["personas"].values())
+            state["status"] = "completed" if finished else "incomplete"
+            await self._save(state)
+        finally:
+            self._save_locks.pop(state["scenario_id"], None)
+        return state
+
+    async def _run_persona(self, state, persona_id, on_progress):
+        progress = state["personas"][persona_id]
+        turns = state["turns"]
+
+        async def emit(event):
+            if on_progress is not None:
+                await on_progress(dict(event, scenario_id=state["scenario_id"], persona_id=persona_id,
+                                       total_turns=len(turns)))
+
+        for turn_index in range(progress["completed_turns"], len(turns)):
+            # The slot is held for one turn only, so other personas' chains interleave
+            async with self.admission.upstream(background=True) as ticket:
+                await emit({"turn": turn_index, "status": "started"})
+                call = PersonaCall(persona_id, turn_index)
+                chunks = self.make_stream(call, turns[turn_index], progress["previous_response_id"])
+                worker = asyncio.ensure_future(run_in_threadpool(call.consume, chunks))
+                try:
+                    await asyncio.shield(worker)
+                except asyncio.CancelledError:
+                    call.cancel()
+                    # The thread may still be blocked on the network; it keeps the slot until it returns
+                    ticket.hold({worker})
+                    raise
+                result = call.result()
+                if result["status"] not in (COMPLETED, TRUNCATED):
+                    ticket.fail()
+
+            if result["status"] not in (COMPLETED, TRUNCATED):
+                # Later turns build on this one, so the chain stops here; a resume retries it
+                progress["error"] = result.get("detail") or result["status"]
+                await self._save(state)
+                await emit({"turn": turn_index, "status": "error", "message": progress["error"]})
+                return
+
+            progress["responses"].append({
+                "turn": turn_index,
+                "response": result["response"],
+                "response_id": result["response_id"],
+                "status": result["status"],
+            })
+            progress["previous_response_id"] = result["response_id"]
+            progress["completed_turns"] = turn_index + 1
+            progress.pop("error", None)
+            await self._save(state)
+            await emit({
+                "turn": turn_index,
+                "status": result["status"],
+                "response": result["response"],
+                "response_id": result["response_id"],
+            })
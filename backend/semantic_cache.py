@@ -0,0 +1,119 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_prompt(text):
+    """Lowercase, trim and collapse whitespace so trivial edits embed identically"""
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+class SemanticCache:
+    """Near-duplicate response cache over a bounded in-memory vector index.
+
+    Each entry is one row of a preallocated NumPy matrix holding the unit-normalized
+    embedding of a persona's (normalized) message. Lookups are a single matrix-vector
+    product restricted to the rows belonging to the same persona; the best row wins
+    if its cosine similarity reaches the threshold. When the index is full the least
+    recently used row is evicted and reused.
+
+    `latency_saved` is net: upstream latency avoided on hits minus the time spent
+    embedding and searching on every lookup, hits and misses alike.
+    """
+
+    def __init__(self, embed_fn: Callable[[str], List[float]], threshold: float = 0.92,
+                 max_entries: int = 1024):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+        self._vectors: Optional[np.ndarray] = None  # allocated on first insert, once the dimension is known
+        self._personas: List[Optional[str]] = [None] * max_entries
+        self._entries: Dict[int, dict] = {}
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    def embed(self, message):
+        """Unit-normalized embedding of the normalized message; pass it to lookup/store to embed only once"""
+        start = time.perf_counter()
+        vector = np.asarray(self.embed_fn(normalize_prompt(message)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        with self._lock:
+            self.latency_saved -= time.perf_counter() - start
+        return vector / norm if norm else vector
+
+    def lookup(self, persona_id, message, vector=None):
+        """Return the cached entry for a near-duplicate message, or None on a miss"""
+        if vector is None:
+            vector = self.embed(message)
+
+        start = time.perf_counter()
+        with self._lock:
+            rows = [slot for slot in self._lru if self._personas[slot] == persona_id]
+            if rows:
+                scores = self._vectors[rows] @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    slot = rows[best]
+                    entry = self._entries[slot]
+                    self._lru.move_to_end(slot)
+                    self.hits += 1
+                    self.latency_saved += entry["latency"] - (time.perf_counter() - start)
+                    return dict(entry, similarity=float(scores[best]))
+            self.misses += 1
+            self.latency_saved -= time.perf_counter() - start
+        return None
+
+    def store(self, persona_id, message, response, latency=0.0, vector=None):
+        """Insert a fresh upstream response, evicting the least recently used entry if full.
+
+        Response ids are deliberately not kept: a hit may be served to another client,
+        and chaining from it would continue a conversation holding someone else's prompt.
+        """
+        if vector is None:
+            vector = self.embed(message)
+
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+            if len(self._entries) < self.max_entries:
+                slot = len(self._entries)
+            else:
+                slot, _ = self._lru.popitem(last=False)
+
+            self._vectors[slot] = vector
+            self._personas[slot] = persona_id
+            self._entries[slot] = {
+                "message": message,
+                "response": response,
+                "latency": latency,
+            }
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def clear(self):
+        with self._lock:
+            self._personas = [None] * self.max_entries
+            self._entries.clear()
+            self._lru.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+        }
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark for the backend: import-time breakdown and time-to-ready
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that should only be loaded on first use, never by `import main`
+HEAVY_MODULES = ("openai", "numpy", "boto3", "google.generativeai", "uvicorn")
+
+def measure_import(module="main"):
+    """Import `module` in a fresh interpreter with -X importtime.
+
+    Returns (total_seconds, rows, heavy, output): rows are (cumulative_us, self_us, name)
+    sorted slowest first, heavy lists the heavy modules that got loaded and output is
+    whatever the import printed.
+    """
+    code = (
+        f"import {module}, sys; "
+        f"print('__HEAVY:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+
+    total = next((cumulative for cumulative, _, name in rows if name == module), 0) / 1e6
+    output, _, heavy = result.stdout.rpartition("__HEAVY:")
+    return total, rows, [m for m in heavy.strip().split(",") if m], output
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_time_to_ready(timeout=30.0):
+    """Seconds from spawning a uvicorn worker until /readyz answers 200"""
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                pass
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode} before becoming ready")
+            time.sleep(0.02)
+        raise TimeoutError(f"worker not ready after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+if __name__ == "__main__":
+    print("Startup Benchmark")
+    print("=" * 30)
+
+    total, rows, heavy, _ = measure_import()
+    print(f"import main: {total * 1000:.1f} ms")
+    print(f"heavy modules loaded at import: {', '.join(heavy) or 'none'}")
+    print()
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in rows[:15]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+    print()
+
+    print(f"time to ready: {measure_time_to_ready() * 1000:.1f} ms")
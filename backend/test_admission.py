@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Tests for admission.py and how main.py identifies clients
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, AIMDLimit
+from config import get_settings
+from main import get_client_id
+
+def test_aimd_grows_while_latency_holds():
+    limit = AIMDLimit(initial=8, min_limit=1, max_limit=64)
+    for _ in range(40):
+        limit.on_sample(0.5)
+    assert int(limit) > 8
+    assert limit.baseline == pytest.approx(0.5)
+
+def test_aimd_backs_off_on_slow_samples():
+    limit = AIMDLimit(initial=8, min_limit=1, max_limit=64)
+    limit.on_sample(0.5)
+    limit.on_sample(5.0)
+    assert limit.limit == pytest.approx((8 + 1 / 8) * 0.7)
+    assert limit.baseline == pytest.approx(0.5)
+
+def test_aimd_failures_back_off_without_learning_latency():
+    limit = AIMDLimit(initial=8, min_limit=2, max_limit=64)
+    for _ in range(10):
+        limit.on_sample(0.0002, ok=False)
+    assert int(limit) == 2
+    assert limit.baseline is None and limit.recent is None
+
+    limit.on_sample(0.5)
+    limit.on_sample(0.0002, ok=False)
+    assert limit.baseline == pytest.approx(0.5)
+
+def test_ticket_fail_records_error_sample():
+    admission = AdmissionController(initial_concurrency=8)
+
+    async def main():
+        async with admission.request("client") as ticket:
+            ticket.fail()
+
+    asyncio.run(main())
+    assert admission.limit.limit == pytest.approx(8 * 0.7)
+    assert admission.limit.baseline is None
+    assert admission.in_flight == 0
+
+def test_too_many_personas():
+    admission = AdmissionController(max_persona_ids=2)
+
+    async def main():
+        async with admission.request("client", ["a", "b", "c"]):
+            pass
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(main())
+    assert rejected.value.status_code == 413
+
+def test_client_rate_limit():
+    admission = AdmissionController(client_requests_per_minute=2)
+
+    async def main():
+        for _ in range(3):
+            async with admission.request("client"):
+                pass
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(main())
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after == 30
+    assert rejected.value.headers == {"Retry-After": "30"}
+
+def test_client_in_flight_limit():
+    admission = AdmissionController(client_max_in_flight=1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.request("client"):
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with admission.request("client"):
+                    pass
+            assert rejected.value.status_code == 429
+            # Other clients are unaffected
+            async with admission.request("other"):
+                pass
+        finally:
+            release.set()
+            await holder
+
+    asyncio.run(main())
+
+def test_queue_timeout_and_overflow():
+    admission = AdmissionController(initial_concurrency=1, max_queue=1, queue_timeout=0.05)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold(client_id):
+            async with admission.request(client_id):
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold("a"))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(hold("b"))
+        await asyncio.sleep(0)
+        assert admission.waiting == 1
+
+        with pytest.raises(AdmissionRejected) as overflow:
+            async with admission.request("c"):
+                pass
+        assert overflow.value.status_code == 503
+
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await waiter
+        assert timed_out.value.status_code == 503
+
+        release.set()
+        await holder
+        assert admission.in_flight == 0 and admission.waiting == 0
+        assert admission.rejected == 2
+
+    asyncio.run(main())
+
+def test_background_waits_past_queue_timeout():
+    admission = AdmissionController(initial_concurrency=1, max_queue=0, queue_timeout=0.05)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.upstream():
+                await release.wait()
+
+        async def turn():
+            async with admission.upstream(background=True) as ticket:
+                return ticket.slots
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(turn())
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        assert admission.background_waiting == 1 and admission.waiting == 0
+
+        release.set()
+        await holder
+        assert await waiter == 1
+        assert admission.in_flight == 0 and admission.rejected == 0
+
+    asyncio.run(main())
+
+def test_client_id_header_needs_trusted_proxy(monkeypatch):
+    def connection(peer, client_id):
+        return SimpleNamespace(client=SimpleNamespace(host=peer), headers={"x-client-id": client_id},
+                               query_params={})
+
+    monkeypatch.setattr(get_settings(), "trusted_proxies", "10.0.0.1, 10.0.0.2")
+    assert get_client_id(connection("203.0.113.9", "fresh-id")) == "203.0.113.9"
+    assert get_client_id(connection("10.0.0.2", "user-42")) == "user-42"
+    assert get_client_id(connection("10.0.0.2", "")) == "10.0.0.2"
+
+def test_fanout_takes_the_free_slots_instead_of_waiting_for_all():
+    admission = AdmissionController(initial_concurrency=8, queue_timeout=0.05)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def chat():
+            async with admission.request("chat-client"):
+                await release.wait()
+
+        holder = asyncio.ensure_future(chat())
+        await asyncio.sleep(0)
+        async with admission.request("multi-client", [f"p{i}" for i in range(8)]) as ticket:
+            assert ticket.slots == 7
+            assert admission.in_flight == 8
+        release.set()
+        await holder
+        assert admission.in_flight == 0
+
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests for context.py
+"""
+
+import sys
+import threading
+import types
+
+import pytest
+
+import context
+from context import ContextAssembler, count_tokens
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # One token per word keeps the budget arithmetic readable
+    monkeypatch.setattr(context, "count_tokens", lambda text, model="gpt-4o": len(text.split()))
+
+def make_assembler(budget=20, summary="summary of early turns"):
+    prompts = []
+    release = threading.Event()
+
+    def summarize(prompt):
+        prompts.append(prompt)
+        release.wait(5)
+        return summary
+
+    return ContextAssembler(summarize, default_budget=budget), prompts, release
+
+def add_turns(assembler, count, words=4):
+    for i in range(count):
+        assembler.add_turn("s", "user" if i % 2 == 0 else "assistant", " ".join([f"t{i}"] * words))
+
+def test_budget_setting_caps_model_ceiling():
+    assembler, _, _ = make_assembler(budget=4000)
+    assert assembler.budget_for("gpt-4o") == 4000
+    assert assembler.budget_for("unknown-model") == 4000
+    assert ContextAssembler(str, default_budget=100000).budget_for("gpt-4o") == 8000
+
+def test_short_history_is_sent_whole():
+    assembler, prompts, _ = make_assembler(budget=20)
+    add_turns(assembler, 3)
+    items, report = assembler.assemble("s", "hello there")
+    assert [item["content"] for item in items] == ["t0 t0 t0 t0", "t1 t1 t1 t1", "t2 t2 t2 t2", "hello there"]
+    assert report == {
+        "budget": 20, "history_tokens": 14, "sent_tokens": 14, "tokens_saved": 0,
+        "turns_in_window": 3, "turns_summarized": 0, "summary_pending": False,
+    }
+    assert prompts == []
+
+def test_window_keeps_newest_turns_and_summarizes_the_rest():
+    assembler, prompts, release = make_assembler(budget=20)
+    add_turns(assembler, 6)
+
+    items, report = assembler.assemble("s", "hello there")
+    # 20 - 2 message tokens leaves room for the newest 4 turns
+    assert [item["content"] for item in items[:-1]] == [f"t{i} t{i} t{i} t{i}" for i in range(2, 6)]
+    assert report["turns_in_window"] == 4
+    assert report["tokens_saved"] == 8
+    assert report["summary_pending"] is True
+
+    pending = assembler._sessions["s"]["pending"]
+    release.set()
+    pending.result(5)
+    # Everything but ~half a budget of recent turns is folded into the summary
+    assert "t3 t3" in prompts[0] and "t4 t4" not in prompts[0]
+    assert assembler._sessions["s"]["summarized_upto"] == 4
+
+    items, report = assembler.assemble("s", "hello there")
+    assert items[0] == {"role": "system", "content": "Summary of the earlier conversation: summary of early turns"}
+    assert [item["content"] for item in items[1:-1]] == ["t4 t4 t4 t4", "t5 t5 t5 t5"]
+    assert report["turns_summarized"] == 4
+    assert report["sent_tokens"] == 4 + 8 + 2
+    assert report["summary_pending"] is False
+
+def test_instructions_are_sent_once():
+    assembler, _, _ = make_assembler(budget=20)
+    add_turns(assembler, 2)
+    items, report = assembler.assemble("s", "hello there", instructions="be a pirate")
+    assert items[0] == {"role": "system", "content": "be a pirate"}
+    assert [item["content"] for item in items].count("be a pirate") == 1
+    assert report["sent_tokens"] == 8 + 2 + 3
+
+@pytest.mark.parametrize("summary", ["Error: upstream down", "No response generated"])
+def test_failed_summary_keeps_previous_state(summary):
+    assembler, _, release = make_assembler(budget=20, summary=summary)
+    add_turns(assembler, 6)
+    assembler.assemble("s", "hello there")
+    pending = assembler._sessions["s"]["pending"]
+    release.set()
+    pending.result(5)
+    session = assembler._sessions["s"]
+    assert session["summary"] == "" and session["summarized_upto"] == 0
+
+def test_count_tokens_falls_back_when_encoding_cannot_load(monkeypatch):
+    loads = []
+
+    def encoding_for_model(model):
+        loads.append(model)
+        raise OSError("offline")
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(encoding_for_model=encoding_for_model))
+    monkeypatch.setattr(context, "_encodings", {})
+    assert count_tokens("x" * 40, "gpt-4o") == 11
+    assert count_tokens("x" * 40, "gpt-4o") == 11
+    assert loads == ["gpt-4o"]
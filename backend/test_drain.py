@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for drain.py and the /healthz and /readyz probes
+"""
+
+import asyncio
+import os
+import signal
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from drain import DrainController
+
+async def stream(seconds):
+    await asyncio.sleep(seconds)
+    return "done"
+
+def test_streams_finishing_within_the_timeout_complete():
+    drain = DrainController(timeout=1.0)
+    drain.ready = True
+
+    async def run():
+        tasks = [drain.track(asyncio.ensure_future(stream(0.05))) for _ in range(3)]
+        assert drain.active_streams == 3
+        await drain.drain()
+        return tasks
+
+    tasks = asyncio.run(run())
+    assert [task.result() for task in tasks] == ["done"] * 3
+    assert drain.active_streams == 0
+    assert drain.draining and not drain.ready
+
+def test_streams_past_the_timeout_are_cancelled():
+    drain = DrainController(timeout=0.05)
+    aborted = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            aborted.append(True)  # where a handler sends its final aborted frame
+            raise
+
+    async def run():
+        quick = drain.track(asyncio.ensure_future(stream(0.01)))
+        stuck = drain.track(asyncio.ensure_future(slow()))
+        await drain.drain()
+        return quick, stuck
+
+    quick, stuck = asyncio.run(run())
+    assert quick.result() == "done"
+    assert stuck.cancelled() and aborted == [True]
+
+def test_signal_drains_then_hands_off():
+    drain = DrainController(timeout=1.0)
+    handed_off, closed = [], []
+    previous_int = signal.getsignal(signal.SIGINT)
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: handed_off.append(signum))
+
+    async def before_exit():
+        closed.append(drain.active_streams)
+
+    async def run():
+        drain.install_signal_handlers(before_exit)
+        drain.ready = True
+        task = drain.track(asyncio.ensure_future(stream(0.1)))
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.sleep(0.01)
+        assert drain.draining and not drain.ready
+        assert not handed_off
+        await task
+        await drain._drain_task
+
+    try:
+        asyncio.run(run())
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        signal.signal(signal.SIGINT, previous_int)
+    assert closed == [0]
+    assert handed_off == [signal.SIGTERM]
+
+@pytest.fixture
+def client():
+    main.get_drain.cache_clear()
+    with TestClient(main.app) as client:
+        yield client
+    main.get_drain.cache_clear()
+
+def test_probes(client):
+    assert client.get("/healthz").status_code == 200
+
+    ready = client.get("/readyz")
+    assert ready.status_code == 200 and ready.json()["status"] == "ready"
+
+    main.get_drain().draining = True
+    main.get_drain().ready = False
+    draining = client.get("/readyz")
+    assert draining.status_code == 503 and draining.json()["status"] == "draining"
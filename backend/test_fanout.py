@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for fanout.py
+"""
+
+import asyncio
+import threading
+import time
+
+import fanout
+from admission import AdmissionController
+from fanout import run_personas
+
+class FakeStream:
+    """Stands in for the OpenAI Stream: close() interrupts a blocked read"""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+def fake_streams(scripts, ignore_close_for=0.0):
+    """make_stream for run_personas.
+
+    Script items are text chunks, None (block until the stream is closed, then fail
+    like an interrupted read) or a callable to run on the worker thread.
+    """
+    streams = {}
+
+    def make_stream(call):
+        stream = streams[call.persona_id] = FakeStream()
+
+        def chunks():
+            call.attach(stream)
+            yield f"__PRID:resp_{call.persona_id}_PRID__"
+            for chunk in scripts[call.persona_id]:
+                if chunk is None:
+                    stream.closed.wait(5)
+                    time.sleep(ignore_close_for)
+                    raise ConnectionError("stream closed")
+                if callable(chunk):
+                    chunk()
+                    continue
+                yield chunk
+
+        return chunks()
+
+    return make_stream, streams
+
+def test_quorum_cancels_the_rest():
+    c_started = threading.Event()
+    make_stream, streams = fake_streams({
+        "a": [lambda: c_started.wait(5), "A"],
+        "b": [lambda: c_started.wait(5), "B"],
+        "c": ["partial ", c_started.set, None],
+    })
+    results, summary = asyncio.run(run_personas(["a", "b", "c"], make_stream, quorum=2))
+
+    assert summary["quorum_met"] is True and summary["deadline_hit"] is False
+    assert summary["completed"] == ["a", "b"] and summary["cancelled"] == ["c"]
+    assert results[2] == {"persona_id": "c", "response": "partial ", "response_id": "resp_c", "status": "cancelled"}
+    assert streams["c"].closed.is_set()
+
+def test_deadline_keeps_partial_text():
+    make_stream, _ = fake_streams({"a": ["A"], "b": ["half", None]})
+    started = time.perf_counter()
+    results, summary = asyncio.run(run_personas(["a", "b"], make_stream, deadline=0.2))
+
+    assert time.perf_counter() - started < 1.0
+    assert summary["deadline_hit"] is True and summary["quorum_met"] is False
+    assert summary["completed"] == ["a"] and summary["cancelled"] == ["b"]
+    assert results[1]["response"] == "half"
+
+def test_truncated_and_error_statuses():
+    make_stream, _ = fake_streams({
+        "a": ["short", "__INCOMPLETE:max_output_tokens__"],
+        "b": ["__ERROR:server_error__ boom"],
+    })
+    results, summary = asyncio.run(run_personas(["a", "b"], make_stream))
+
+    assert summary["truncated"] == ["a"] and summary["error"] == ["b"]
+    assert results[0]["detail"] == "max_output_tokens"
+    assert results[1]["detail"] == "__ERROR:server_error__ boom"
+
+def test_stranded_calls_keep_their_admission_slots(monkeypatch):
+    monkeypatch.setattr(fanout, "CANCEL_GRACE", 0.05)
+    b_started = threading.Event()
+    make_stream, _ = fake_streams({"a": [lambda: b_started.wait(5), "A"], "b": [b_started.set, None]},
+                                  ignore_close_for=0.3)
+    admission = AdmissionController(initial_concurrency=8)
+
+    async def main():
+        async with admission.request("client", ["a", "b"]) as ticket:
+            _, summary = await run_personas(["a", "b"], make_stream, quorum=1,
+                                            max_parallel=ticket.slots, on_stranded=ticket.hold)
+        assert summary["cancelled"] == ["b"]
+        assert admission.in_flight == 1 and admission.stranded == 1
+        await asyncio.sleep(0.5)
+        assert admission.in_flight == 0 and admission.stranded == 0
+
+    asyncio.run(main())
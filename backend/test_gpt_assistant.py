@@ -3,7 +3,7 @@
 Test script for gpt_assistant.py
 """
 
-import os
+from config import get_settings
 from gpt_assistant import stream_assistant_response, get_non_streaming_response
 
 def test_non_streaming():
@@ -33,10 +33,10 @@ if __name__ == "__main__":
     print("GPT Assistant Test")
     print("=" * 30)
     
-    # Check if API key is set
-    api_key = os.getenv("OPENAI_API_KEY")
+    # Check if API key is set (environment or .env, as the app reads it)
+    api_key = get_settings().openai_api_key
     if not api_key:
-        print("Warning: OPENAI_API_KEY not found in environment variables")
+        print("Warning: OPENAI_API_KEY not found in environment variables or .env")
         print("Please set your OpenAI API key to test the assistant")
         exit(1)
     
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Tests for scenario.py
+"""
+
+import asyncio
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from admission import AdmissionController
+from scenario import ScenarioRunner, ScenarioRunning, _process_started
+
+class FakeStream:
+    """Stands in for the OpenAI Stream: close() interrupts a blocked read"""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+def fake_turns(scripts=None):
+    """make_stream for ScenarioRunner, answering "<persona>:<turn>" with response id "<persona>-<turn index>".
+
+    `scripts[(persona_id, turn_index)]` overrides a turn: a list of text chunks, None
+    (block until the stream is closed) or callables to run on the worker thread.
+    Every call is recorded as (persona_id, turn_index, previous_response_id).
+    """
+    scripts = scripts or {}
+    calls = []
+
+    def make_stream(call, turn, previous_response_id):
+        calls.append((call.persona_id, call.index, previous_response_id))
+        stream = FakeStream()
+
+        def chunks():
+            call.attach(stream)
+            yield f"__PRID:{call.persona_id}-{call.index}_PRID__"
+            for chunk in scripts.get((call.persona_id, call.index), [f"{call.persona_id}:{turn}"]):
+                if chunk is None:
+                    stream.closed.wait(5)
+                    raise ConnectionError("stream closed")
+                if callable(chunk):
+                    chunk()
+                    continue
+                yield chunk
+
+        return chunks()
+
+    return make_stream, calls
+
+@pytest.fixture
+def checkpoint_dir(tmp_path):
+    return str(tmp_path)
+
+def run(runner, state, on_progress=None):
+    return asyncio.run(runner.run(state, on_progress))
+
+def test_personas_chain_their_own_turns(checkpoint_dir):
+    make_stream, calls = fake_turns()
+    runner = ScenarioRunner(make_stream, AdmissionController(), checkpoint_dir)
+    state = run(runner, runner.new_state(["hi", "why", "bye"], ["a", "b", "a"], "study"))
+
+    assert state["status"] == "completed"
+    assert state["persona_ids"] == ["a", "b"]
+    for persona_id in ("a", "b"):
+        assert [call for call in calls if call[0] == persona_id] == [
+            (persona_id, 0, None), (persona_id, 1, f"{persona_id}-0"), (persona_id, 2, f"{persona_id}-1"),
+        ]
+        progress = state["personas"][persona_id]
+        assert progress["completed_turns"] == 3
+        assert [r["response"] for r in progress["responses"]] == [f"{persona_id}:{t}" for t in ("hi", "why", "bye")]
+    assert runner.load("study") == state
+
+def test_no_barrier_between_turns(checkpoint_dir):
+    # "slow" cannot finish its first turn until "fast" has finished all of its turns
+    fast_done = threading.Event()
+    make_stream, _ = fake_turns({
+        ("slow", 0): [lambda: fast_done.wait(5), "late"],
+        ("fast", 2): ["last", fast_done.set],
+    })
+    runner = ScenarioRunner(make_stream, AdmissionController(), checkpoint_dir)
+    events = []
+
+    async def on_progress(event):
+        if event["status"] == "completed":
+            events.append((event["persona_id"], event["turn"]))
+
+    state = run(runner, runner.new_state(["1", "2", "3"], ["slow", "fast"]), on_progress)
+    assert state["status"] == "completed"
+    assert events.index(("fast", 2)) < events.index(("slow", 0))
+
+def test_checkpoint_after_every_turn(checkpoint_dir):
+    runner = None
+    seen = []
+
+    def check_checkpoint():
+        # Runs as turn n starts: the file on disk already records turns 0..n-1
+        seen.append(runner.load("study")["personas"]["a"]["completed_turns"])
+
+    make_stream, _ = fake_turns({("a", turn): [check_checkpoint, "ok"] for turn in range(3)})
+    runner = ScenarioRunner(make_stream, AdmissionController(), checkpoint_dir)
+    run(runner, runner.new_state(["1", "2", "3"], ["a"], "study"))
+    assert seen == [0, 1, 2]
+
+def test_resume_after_error(checkpoint_dir):
+    make_stream, _ = fake_turns({("a", 1): ["__ERROR:server_error__ boom"]})
+    runner = ScenarioRunner(make_stream, AdmissionController(), checkpoint_dir)
+    state = run(runner, runner.new_state(["1", "2", "3"], ["a", "b"], "study"))
+
+    assert state["status"] == "incomplete"
+    saved = runner.load("study")
+    assert saved["personas"]["a"]["completed_turns"] == 1
+    assert "boom" in saved["personas"]["a"]["error"]
+    assert saved["personas"]["b"]["completed_turns"] == 3
+
+    make_stream, calls = fake_turns()
+    resumed = ScenarioRunner(make_stream, AdmissionController(), checkpoint_dir)
+    state = run(resumed, resumed.load("study"))
+    assert state["status"] == "completed"
+    assert calls == [("a", 1, "a-0"), ("a", 2, "a-1")]
+    assert "error" not in state["personas"]["a"]
+
+def test_resume_after_cancellation(checkpoint_dir):
+    blocked = threading.Event()
+    make_stream, _ = fake_turns({("a", 1): [blocked.set, None]})
+    admission = AdmissionController()
+    runner = ScenarioRunner(make_stream, admission, checkpoint_dir)
+
+    async def cancel_mid_turn():
+        task = asyncio.ensure_future(runner.run(runner.new_state(["1", "2"], ["a"], "study")))
+        while not blocked.is_set():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The cancelled turn's stream was closed, so its thread returns and frees its slot
+        await asyncio.sleep(0.1)
+        assert admission.in_flight == 0
+
+    asyncio.run(cancel_mid_turn())
+    assert runner.load("study")["personas"]["a"]["completed_turns"] == 1
+
+    make_stream, calls = fake_turns()
+    resumed = ScenarioRunner(make_stream, AdmissionController(), checkpoint_dir)
+    assert run(resumed, resumed.load("study"))["status"] == "completed"
+    assert calls == [("a", 1, "a-0")]
+
+def test_claim_is_exclusive_until_released(checkpoint_dir):
+    runner = ScenarioRunner(fake_turns()[0], AdmissionController(), checkpoint_dir)
+    with runner.claim("study"):
+        with pytest.raises(ScenarioRunning):
+            with runner.claim("study"):
+                pass
+        with runner.claim("other"):
+            pass
+    with pytest.raises(RuntimeError):
+        with runner.claim("study"):
+            raise RuntimeError("boom")
+    with runner.claim("study"):
+        pass
+    assert os.listdir(checkpoint_dir) == []
+
+def write_lock(checkpoint_dir, **owner):
+    lock = dict({"host": socket.gethostname(), "pid": os.getpid(), "started": _process_started(os.getpid()),
+                 "token": "other"}, **owner)
+    with open(os.path.join(checkpoint_dir, "study.json.lock"), "w") as f:
+        json.dump(lock, f)
+
+@pytest.mark.parametrize("owner", [
+    {"pid": 999999999},  # the owner is gone
+    {"started": "reused"},  # the pid now belongs to a newer process
+])
+def test_claim_takes_over_stale_lock(checkpoint_dir, owner):
+    if "started" in owner and _process_started(os.getpid()) is None:
+        pytest.skip("process start times need /proc")
+    write_lock(checkpoint_dir, **owner)
+    runner = ScenarioRunner(fake_turns()[0], AdmissionController(), checkpoint_dir)
+    with runner.claim("study"):
+        with open(os.path.join(checkpoint_dir, "study.json.lock")) as f:
+            assert json.load(f)["pid"] == os.getpid()
+    assert os.listdir(checkpoint_dir) == []
+
+@pytest.mark.parametrize("owner", [{}, {"host": "another-host", "pid": 999999999}])
+def test_claim_respects_live_or_remote_lock(checkpoint_dir, owner):
+    write_lock(checkpoint_dir, **owner)
+    runner = ScenarioRunner(fake_turns()[0], AdmissionController(), checkpoint_dir)
+    with pytest.raises(ScenarioRunning):
+        with runner.claim("study"):
+            pass
+    assert os.listdir(checkpoint_dir) == ["study.json.lock"]
+
+def test_claim_rejects_invalid_id(checkpoint_dir):
+    runner = ScenarioRunner(fake_turns()[0], AdmissionController(), checkpoint_dir)
+    with pytest.raises(ValueError):
+        with runner.claim("../etc"):
+            pass
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for semantic_cache.py
+"""
+
+import time
+
+from semantic_cache import SemanticCache, normalize_prompt
+
+VECTORS = {
+    "favorite language": [1.0, 0.0, 0.0],
+    "which language do you like most": [0.95, 0.31, 0.0],
+    "what is the weather": [0.0, 1.0, 0.0],
+    "pizza or pasta": [0.0, 0.0, 1.0],
+}
+
+def make_cache(threshold=0.9, max_entries=8):
+    calls = []
+
+    def embed(text):
+        calls.append(text)
+        return VECTORS[text]
+
+    return SemanticCache(embed, threshold=threshold, max_entries=max_entries), calls
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Favorite\n  LANGUAGE ") == "favorite language"
+
+def test_threshold():
+    cache, _ = make_cache(threshold=0.9)
+    cache.store("dev", "favorite language", "Python")
+
+    hit = cache.lookup("dev", "Which language do you like most")
+    assert hit["response"] == "Python"
+    assert hit["similarity"] >= 0.9
+    assert "response_id" not in hit
+    assert cache.lookup("dev", "what is the weather") is None
+
+    strict, _ = make_cache(threshold=0.99)
+    strict.store("dev", "favorite language", "Python")
+    assert strict.lookup("dev", "which language do you like most") is None
+
+def test_personas_are_isolated():
+    cache, _ = make_cache()
+    cache.store("dev", "favorite language", "Python")
+    assert cache.lookup("writer", "favorite language") is None
+    assert cache.lookup("dev", "favorite language")["response"] == "Python"
+
+def test_lru_eviction():
+    cache, _ = make_cache(max_entries=2)
+    cache.store("dev", "favorite language", "Python")
+    cache.store("dev", "what is the weather", "Sunny")
+    # Touch the first entry so the second becomes least recently used
+    assert cache.lookup("dev", "favorite language") is not None
+    cache.store("dev", "pizza or pasta", "Pasta")
+
+    assert cache.lookup("dev", "what is the weather") is None
+    assert cache.lookup("dev", "favorite language")["response"] == "Python"
+    assert cache.lookup("dev", "pizza or pasta")["response"] == "Pasta"
+    assert cache.stats()["entries"] == 2
+
+def test_precomputed_vector_is_reused():
+    cache, calls = make_cache()
+    vector = cache.embed("favorite language")
+    assert cache.lookup("dev", "favorite language", vector=vector) is None
+    cache.store("dev", "favorite language", "Python", vector=vector)
+    assert calls == ["favorite language"]
+
+def test_stats():
+    cache, _ = make_cache()
+    cache.store("dev", "favorite language", "Python", latency=2.0)
+    cache.lookup("dev", "favorite language")
+    cache.lookup("dev", "what is the weather")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+    assert 0 < stats["latency_saved_seconds"] <= 2.0
+
+def test_misses_cost_their_embedding():
+    def slow_embed(text):
+        time.sleep(0.02)
+        return VECTORS[text]
+
+    cache = SemanticCache(slow_embed, threshold=0.9)
+    cache.lookup("dev", "favorite language")
+    assert cache.stats()["latency_saved_seconds"] <= -0.02
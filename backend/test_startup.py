@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Tests for cold start budgets (override with STARTUP_IMPORT_BUDGET / STARTUP_READY_BUDGET)
+"""
+
+import os
+import subprocess
+import sys
+from startup_benchmark import BACKEND_DIR, measure_import, measure_time_to_ready
+
+IMPORT_BUDGET = float(os.getenv("STARTUP_IMPORT_BUDGET", "1.0"))
+READY_BUDGET = float(os.getenv("STARTUP_READY_BUDGET", "3.0"))
+
+def test_import_has_no_side_effects():
+    _, _, heavy, output = measure_import()
+    assert heavy == [], f"heavy modules imported eagerly: {heavy}"
+    assert output.strip() == "", f"import printed output: {output!r}"
+
+def test_import_builds_no_settings():
+    code = "import main, config; print(config.get_settings.cache_info().currsize, main.get_admission.cache_info().currsize)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["0", "0"]
+
+def test_import_time_budget():
+    total, rows, _, _ = measure_import()
+    slowest = ", ".join(f"{name} {cumulative / 1000:.0f}ms" for cumulative, _, name in rows[1:6])
+    assert total < IMPORT_BUDGET, f"import main took {total:.3f}s (budget {IMPORT_BUDGET}s); slowest: {slowest}"
+
+def test_time_to_ready_budget():
+    elapsed = measure_time_to_ready()
+    assert elapsed < READY_BUDGET, f"worker took {elapsed:.3f}s to become ready (budget {READY_BUDGET}s)"